@@ -1,72 +1,168 @@
 """
-Refactored engine with safe rule parsing, JSON-serializable state, and logging.
+Refactored engine with safe rule parsing, in-memory session state, and logging.
 """
 
 import csv
 import hashlib
 import json
 import logging
+import operator
 import os
 import random
-from typing import Any, Dict, List
+from collections import defaultdict
+from typing import Annotated, Any, Dict, List, Optional, Tuple
 
 import yaml
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
 
 from tss_crypto import tss_create, tss_reconstruct
 
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Course+TSS", version="1.0.0")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed."""
+
+    def render(self, content: Any) -> bytes:
+        if ORJSON_AVAILABLE:
+            try:
+                return orjson.dumps(content)
+            except TypeError:  # e.g. integers beyond 64 bits, lone surrogates
+                pass
+        try:
+            return super().render(content)
+        except UnicodeEncodeError:
+            # Lone surrogates have no UTF-8 form; send them as \u escapes
+            return json.dumps(
+                content, ensure_ascii=True, allow_nan=False, separators=(",", ":")
+            ).encode("ascii")
+
+
+json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
+app = FastAPI(
+    title="Course+TSS", version="1.0.0", default_response_class=FastJSONResponse
+)
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
 )
 
-# Mount static files after API routes are defined (at the end of file)
-# if os.path.exists("index.html"):
-#     app.mount("/", StaticFiles(directory=".", html=True), name="static")
+
+def _load_rules_cached(filepath: str) -> Dict[str, Any]:
+    """
+    Load rules through a JSON sidecar cache next to the YAML file.
+
+    The YAML file stays authoritative: the sidecar records the sha256 of the
+    YAML it was built from and is only used while that still matches, so
+    copies that keep old mtimes (tar, rsync -a, cp -p) never serve stale
+    rules. The sidecar is written back atomically so concurrent workers never
+    observe a partial cache.
+    """
+    cache_path = f"{filepath}.json"
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("sha256") == digest:
+            return cached["rules"]
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+
+    rules = yaml.safe_load(raw.decode("utf-8"))
+
+    try:
+        encoded = json.dumps({"sha256": digest, "rules": rules})
+        # Only cache rules that survive a JSON round-trip unchanged
+        if json.loads(encoded)["rules"] == rules:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(encoded)
+            os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Could not write rules cache {cache_path}: {e}")
+    return rules
 
 
 def load_rules(filepath: str = "adaptive_rules.yaml") -> Dict[str, Any]:
     """Load rules from YAML file safely."""
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            rules = yaml.safe_load(f)
-            logger.info(f"Loaded rules from {filepath}")
-            return rules
+        rules = _load_rules_cached(filepath)
+        logger.info(f"Loaded rules from {filepath}")
+        return rules
     except Exception as e:
         logger.error(f"Failed to load rules: {e}")
         return {}
 
 
+QUESTION_FIELDS = (
+    "id",
+    "module",
+    "topic",
+    "difficulty",
+    "type",
+    "stem",
+    "choices",
+    "answer_key",
+    "rationale",
+    "tags",
+)
+
+
 def load_question_bank(
     filepath: str = "question_bank.csv",
 ) -> Dict[int, Dict[str, Any]]:
     """Load question bank from CSV file."""
     bank = {}
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
+        with open(filepath, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = {name: i for i, name in enumerate(next(reader))}
+            fields = operator.itemgetter(*(header[name] for name in QUESTION_FIELDS))
             for row in reader:
-                qid = int(row["id"])
+                if not row:
+                    continue
+                (
+                    qid,
+                    module,
+                    topic,
+                    difficulty,
+                    qtype,
+                    stem,
+                    choices,
+                    answer_key,
+                    rationale,
+                    tags,
+                ) = fields(row)
+                qid = int(qid)
                 bank[qid] = {
                     "id": qid,
-                    "module": int(row["module"]),
-                    "topic": row["topic"],
-                    "difficulty": int(row["difficulty"]),
-                    "type": row["type"],
-                    "stem": row["stem"],
-                    "choices": json.loads(row["choices"]),
-                    "answer_key": row["answer_key"],
-                    "rationale": row["rationale"],
-                    "tags": row["tags"].split("|") if row["tags"] else [],
+                    "module": int(module),
+                    "topic": topic,
+                    "difficulty": int(difficulty),
+                    "type": qtype,
+                    "stem": stem,
+                    "choices": json_loads(choices),
+                    "answer_key": answer_key,
+                    "rationale": rationale,
+                    "tags": tags.split("|") if tags else [],
                 }
         logger.info(f"Loaded {len(bank)} questions from {filepath}")
     except Exception as e:
@@ -74,8 +170,82 @@ def load_question_bank(
     return bank
 
 
+def build_module_index(bank: Dict[int, Dict[str, Any]]) -> Dict[int, List[int]]:
+    """Group question ids by module so picking never scans the whole bank."""
+    index: Dict[int, List[int]] = defaultdict(list)
+    for qid, question in bank.items():
+        index[question["module"]].append(qid)
+    return dict(index)
+
+
+def build_role_pools(
+    role_prefer: Dict[str, Tuple[int, ...]], module_index: Dict[int, List[int]]
+) -> Dict[str, Tuple[int, ...]]:
+    """
+    Resolve each role's preferred modules to its candidate question ids.
+
+    Roles whose modules hold no questions are left out so picking falls back
+    to the whole bank for them.
+    """
+    pools: Dict[str, Tuple[int, ...]] = {}
+    for role, modules in role_prefer.items():
+        pool = tuple(
+            qid
+            for module in dict.fromkeys(modules)
+            for qid in module_index.get(module, [])
+        )
+        if pool:
+            pools[role] = pool
+    return pools
+
+
+def parse_condition(rule_condition: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a simple equality condition into its (name, value) pair.
+
+    Returns None for conditions that are not equality checks and raises
+    ValueError for chained ones like "a == b == c".
+    """
+    # Parse simple conditions like "role == 'instructor'"
+    if "==" not in rule_condition:
+        return None
+    left, right = rule_condition.split("==")
+    return left.strip(), right.strip().strip("'\"")
+
+
+def compile_role_rules(rules: Dict[str, Any]) -> Dict[str, Tuple[int, ...]]:
+    """
+    Flatten role branch rules into a role -> preferred modules lookup.
+
+    Conditions are parsed once here so picking a question is a single dict
+    lookup instead of evaluating every rule string per request.
+    """
+    role_prefer: Dict[str, List[int]] = defaultdict(list)
+    for rule in rules.get("branches", {}).get("role", []):
+        try:
+            condition = parse_condition(str(rule.get("when", "")))
+        except ValueError:
+            condition = None
+        if condition is None or condition[0] != "role":
+            logger.warning(f"Unsupported rule condition: {rule.get('when')}")
+            continue
+        role_prefer[condition[1]].extend(rule.get("prefer_modules", []))
+    return {role: tuple(modules) for role, modules in role_prefer.items()}
+
+
 RULES = load_rules()
+ROLE_PREFER = compile_role_rules(RULES)
+FEEDBACK_CORRECT = RULES.get("feedback", {}).get("correct", "No feedback available")
+FEEDBACK_INCORRECT = RULES.get("feedback", {}).get("incorrect", "No feedback available")
 BANK = load_question_bank()
+# Client-facing copies of each question with the answer key stripped
+BANK_PUBLIC = {
+    qid: {k: v for k, v in q.items() if k != "answer_key"} for qid, q in BANK.items()
+}
+MODULE_INDEX = build_module_index(BANK)
+ALL_IDS: List[int] = list(BANK)
+ROLE_POOLS = build_role_pools(ROLE_PREFER, MODULE_INDEX)
+PICK_DRAWS = 8
 STATE: Dict[str, Dict[str, Any]] = {}
 
 
@@ -100,14 +270,12 @@ def safe_eval_rule(rule_condition: str, variables: Dict[str, Any]) -> bool:
     Only supports simple equality checks for now.
     """
     try:
-        # Parse simple conditions like "role == 'instructor'"
-        if "==" in rule_condition:
-            left, right = rule_condition.split("==")
-            left = left.strip()
-            right = right.strip().strip("'\"")
-            return variables.get(left) == right
-        logger.warning(f"Unsupported rule condition: {rule_condition}")
-        return False
+        condition = parse_condition(rule_condition)
+        if condition is None:
+            logger.warning(f"Unsupported rule condition: {rule_condition}")
+            return False
+        left, right = condition
+        return variables.get(left) == right
     except Exception as e:
         logger.error(f"Error evaluating rule: {e}")
         return False
@@ -115,58 +283,41 @@ def safe_eval_rule(rule_condition: str, variables: Dict[str, Any]) -> bool:
 
 def pick_question(state: Dict[str, Any]) -> Dict[str, Any]:
     """Pick next question based on state and rules."""
+    # Pools are resolved at load time; unknown or non-string roles use the bank
     role = state.get("role", "support")
-    preferred_modules: List[int] = []
-
-    # Safe rule evaluation
-    for rule in RULES.get("branches", {}).get("role", []):
-        try:
-            if safe_eval_rule(rule.get("when", ""), {"role": role}):
-                preferred_modules.extend(rule.get("prefer_modules", []))
-        except Exception as e:
-            logger.warning(f"Error processing rule: {e}")
+    pool_ids = ROLE_POOLS.get(role, ALL_IDS) if isinstance(role, str) else ALL_IDS
 
-    # Filter questions
-    candidates = [
-        q
-        for q in BANK.values()
-        if not preferred_modules or q["module"] in preferred_modules
-    ]
+    # Draw random ids until one is unattempted; usually the first draw hits
+    attempted = state.get("attempted", ())
+    for _ in range(PICK_DRAWS):
+        qid = random.choice(pool_ids)
+        if qid not in attempted:
+            return BANK[qid]
 
-    if not candidates:
-        candidates = list(BANK.values())
-
-    random.shuffle(candidates)
-
-    # Find unattempted question
-    attempted = state.get("attempted", [])
-    for question in candidates:
-        if question["id"] not in attempted:
-            return question
-
-    # Return first candidate if all attempted
-    return candidates[0] if candidates else list(BANK.values())[0]
+    # Mostly-attempted pool: choose among what is left, or any candidate
+    remaining = [qid for qid in pool_ids if qid not in attempted]
+    return BANK[random.choice(remaining or pool_ids)]
 
 
 @app.post("/questionnaire/next")
-def next_question(req: NextReq):
+async def next_question(req: NextReq):
     """Get next question for session."""
-    # Initialize state with JSON-serializable attempted list
+    # Initialize state; attempted ids live in a set for O(1) membership
     state = STATE.setdefault(
-        req.session_id, {"attempted": [], "correct": 0, "total": 0, **req.context}
+        req.session_id, {**req.context, "attempted": set(), "correct": 0, "total": 0}
     )
     question = pick_question(state)
     logger.info(f"Session {req.session_id}: next question {question['id']}")
 
     # Return question without answer key
-    return {"question": {k: v for k, v in question.items() if k != "answer_key"}}
+    return {"question": BANK_PUBLIC[question["id"]]}
 
 
 @app.post("/questionnaire/submit")
-def submit_answer(req: SubmitReq):
+async def submit_answer(req: SubmitReq):
     """Submit answer and get feedback."""
     state = STATE.setdefault(
-        req.session_id, {"attempted": [], "correct": 0, "total": 0}
+        req.session_id, {"attempted": set(), "correct": 0, "total": 0}
     )
 
     question = BANK.get(req.question_id)
@@ -174,9 +325,8 @@ def submit_answer(req: SubmitReq):
         logger.warning(f"Question {req.question_id} not found")
         raise HTTPException(404, "Question not found")
 
-    # Update state (use list instead of set for JSON serialization)
-    if question["id"] not in state["attempted"]:
-        state["attempted"].append(question["id"])
+    # Update state
+    state["attempted"].add(question["id"])
 
     state["total"] += 1
     is_correct = str(req.selected) == question["answer_key"]
@@ -184,9 +334,7 @@ def submit_answer(req: SubmitReq):
     if is_correct:
         state["correct"] += 1
 
-    feedback = RULES.get("feedback", {}).get(
-        "correct" if is_correct else "incorrect", "No feedback available"
-    )
+    feedback = FEEDBACK_CORRECT if is_correct else FEEDBACK_INCORRECT
 
     score = round(state["correct"] / state["total"], 3) if state["total"] > 0 else 0
 
@@ -206,6 +354,8 @@ def submit_answer(req: SubmitReq):
 # TSS demo endpoints (in-memory)
 PAYLOADS: Dict[str, Dict[str, Any]] = {}
 SHARES: Dict[str, Dict[str, str]] = {}
+# Upper bound on /tss/events so one request cannot hold the worker indefinitely
+MAX_TSS_BATCH = 100
 
 
 class TSSEventIn(BaseModel):
@@ -224,38 +374,75 @@ class TSSReconIn(BaseModel):
     reason: str
 
 
+def _seal_tss_event(event: TSSEventIn) -> Tuple[str, Dict[str, Any]]:
+    """Encrypt and split an event, returning its payload id and artifact."""
+    artifact = tss_create(
+        {
+            "org_id": event.org_id,
+            "event_type": event.event_type,
+            "payload": event.payload,
+        },
+        threshold=2,
+    )
+
+    # Derived from the raw ciphertext digest, truncated before hex encoding
+    return artifact["cipher_digest"][:8].hex(), artifact
+
+
+def _store_tss_event(payload_id: str, artifact: Dict[str, Any]) -> Dict[str, str]:
+    """Record a sealed event and return its demo shares by role."""
+    PAYLOADS[payload_id] = {
+        "cipher": artifact["cipher"],
+        "hash": artifact["payload_hash"],
+    }
+    SHARES[payload_id] = {
+        s["owner_role"]: s["wrapped_share"] for s in artifact["shares"]
+    }
+    return SHARES[payload_id]
+
+
 @app.post("/tss/event")
 def create_tss_event(event: TSSEventIn):
     """Create TSS-protected event."""
     try:
-        artifact = tss_create(
-            {
-                "org_id": event.org_id,
-                "event_type": event.event_type,
-                "payload": event.payload,
-            },
-            threshold=2,
-        )
-
-        payload_id = hashlib.sha256(
-            artifact["cipher"]["ciphertext_b64"].encode()
-        ).hexdigest()[:16]
-
-        PAYLOADS[payload_id] = {
-            "cipher": artifact["cipher"],
-            "hash": artifact["payload_hash"],
-        }
-        SHARES[payload_id] = {
-            s["owner_role"]: s["wrapped_share"] for s in artifact["shares"]
-        }
+        payload_id, artifact = _seal_tss_event(event)
+        shares = _store_tss_event(payload_id, artifact)
 
         logger.info(f"Created TSS event with ID {payload_id}")
-        return {"payload_id": payload_id, "shares_demo": SHARES[payload_id]}
+        return {"payload_id": payload_id, "shares_demo": shares}
+    except ValueError as e:
+        # Payloads tss_create cannot represent faithfully, e.g. NaN
+        logger.warning(f"Rejected TSS event: {e}")
+        raise HTTPException(422, f"Invalid payload: {str(e)}")
     except Exception as e:
         logger.error(f"Failed to create TSS event: {e}")
         raise HTTPException(500, f"Failed to create TSS event: {str(e)}")
 
 
+@app.post("/tss/events")
+def create_tss_events(
+    events: Annotated[List[TSSEventIn], Field(max_length=MAX_TSS_BATCH)],
+):
+    """Create several TSS-protected events in one request."""
+    try:
+        # Seal everything first so a failure stores none of the batch
+        sealed = [_seal_tss_event(event) for event in events]
+        created = []
+        for payload_id, artifact in sealed:
+            shares = _store_tss_event(payload_id, artifact)
+            created.append({"payload_id": payload_id, "shares_demo": shares})
+
+        logger.info(f"Created {len(created)} TSS events")
+        return {"events": created}
+    except ValueError as e:
+        # Payloads tss_create cannot represent faithfully, e.g. NaN
+        logger.warning(f"Rejected TSS events: {e}")
+        raise HTTPException(422, f"Invalid payload: {str(e)}")
+    except Exception as e:
+        logger.error(f"Failed to create TSS events: {e}")
+        raise HTTPException(500, f"Failed to create TSS events: {str(e)}")
+
+
 @app.post("/tss/reconstruct")
 def reconstruct_tss_event(request: TSSReconIn):
     """Reconstruct TSS-protected event."""
@@ -264,9 +451,10 @@ def reconstruct_tss_event(request: TSSReconIn):
         logger.warning(f"Payload {request.payload_id} not found")
         raise HTTPException(404, "Payload not found")
 
-    if len(request.provided_roles) < 2:
+    threshold = record["cipher"]["meta"].get("t", 2)
+    if len(request.provided_roles) < threshold:
         logger.warning("Insufficient shares provided")
-        raise HTTPException(403, "Need at least 2 shares")
+        raise HTTPException(403, f"Need at least {threshold} shares")
 
     try:
         data = tss_reconstruct(record["cipher"], request.provided_roles)
@@ -277,6 +465,59 @@ def reconstruct_tss_event(request: TSSReconIn):
         raise HTTPException(500, f"Failed to reconstruct payload: {str(e)}")
 
 
-# Mount static files last so API routes take precedence
-if os.path.exists("index.html"):
-    app.mount("/static", StaticFiles(directory=".", html=True), name="static")
+# Front-end assets are read into memory once and served from there
+STATIC_MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript",
+}
+
+
+def load_static_assets(directory: str = ".") -> Dict[str, Tuple[bytes, str, str]]:
+    """Load front-end assets as (body, media type, ETag) keyed by file name."""
+    assets: Dict[str, Tuple[bytes, str, str]] = {}
+    try:
+        for name in sorted(os.listdir(directory)):
+            media_type = STATIC_MEDIA_TYPES.get(os.path.splitext(name)[1])
+            path = os.path.join(directory, name)
+            if media_type is None or not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            assets[name] = (body, media_type, etag)
+    except OSError as e:
+        logger.error(f"Failed to load static assets: {e}")
+    if "index.html" in assets:
+        assets[""] = assets["index.html"]
+    return assets
+
+
+STATIC_ASSETS = load_static_assets()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag.
+
+    Uses the weak comparison If-None-Match calls for: any tag in the
+    comma-separated list may match, W/ prefixes are ignored, and * matches
+    every representation.
+    """
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
+
+
+# StaticFiles answered HEAD as well, so keep it working for existing clients
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+def static_asset(path: str, request: Request):
+    """Serve a preloaded front-end asset."""
+    asset = STATIC_ASSETS.get(path)
+    if asset is None:
+        raise HTTPException(404, "Not found")
+
+    body, media_type, etag = asset
+    headers = {"ETag": etag}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
@@ -2,7 +2,6 @@
 Smoke tests for API endpoints.
 """
 
-import pytest
 from fastapi.testclient import TestClient
 from engine_reference import app
 
@@ -23,6 +22,17 @@ def test_next_question_endpoint():
     assert "answer_key" not in data["question"]
 
 
+def test_next_question_non_string_role():
+    """Test that a non-string role falls back to the whole bank."""
+    for role in (["support"], {"name": "support"}, 3):
+        response = client.post(
+            "/questionnaire/next",
+            json={"session_id": "test-session-role", "context": {"role": role}},
+        )
+        assert response.status_code == 200
+        assert "question" in response.json()
+
+
 def test_submit_answer_endpoint():
     """Test /questionnaire/submit endpoint."""
     # First get a question
@@ -59,10 +69,6 @@ def test_submit_invalid_question():
     assert response.status_code == 404
 
 
-@pytest.mark.skipif(
-    not pytest.importorskip("tss_crypto").SECRETSHARING_AVAILABLE,
-    reason="secretsharing library not installed",
-)
 def test_tss_event_endpoint():
     """Test /tss/event endpoint."""
     response = client.post(
@@ -80,10 +86,33 @@ def test_tss_event_endpoint():
     assert "shares_demo" in data
 
 
-@pytest.mark.skipif(
-    not pytest.importorskip("tss_crypto").SECRETSHARING_AVAILABLE,
-    reason="secretsharing library not installed",
-)
+def test_tss_events_batch_endpoint():
+    """Test /tss/events batch endpoint."""
+    events = [
+        {"org_id": "test-org", "event_type": "test-event", "payload": {"n": n}}
+        for n in range(3)
+    ]
+    response = client.post("/tss/events", json=events)
+
+    assert response.status_code == 200
+    created = response.json()["events"]
+    assert len(created) == 3
+    assert len({event["payload_id"] for event in created}) == 3
+    assert all("shares_demo" in event for event in created)
+
+
+def test_tss_events_batch_limit():
+    """Test that oversized /tss/events batches are rejected before sealing."""
+    from engine_reference import MAX_TSS_BATCH, PAYLOADS
+
+    event = {"org_id": "test-org", "event_type": "test-event", "payload": {}}
+    stored = len(PAYLOADS)
+    response = client.post("/tss/events", json=[event] * (MAX_TSS_BATCH + 1))
+
+    assert response.status_code == 422
+    assert len(PAYLOADS) == stored
+
+
 def test_tss_reconstruct_endpoint():
     """Test /tss/reconstruct endpoint."""
     # First create an event
@@ -122,6 +151,58 @@ def test_tss_reconstruct_endpoint():
     assert data["data"]["payload"] == {"key": "value"}
 
 
+def test_tss_reconstruct_big_integer_payload():
+    """Test that payloads outside orjson's integer range round-trip exactly."""
+    create_data = client.post(
+        "/tss/event",
+        json={"org_id": "test-org", "event_type": "big", "payload": {"n": 10**30}},
+    ).json()
+    shares = create_data["shares_demo"]
+
+    response = client.post(
+        "/tss/reconstruct",
+        json={
+            "payload_id": create_data["payload_id"],
+            "provided_roles": {role: shares[role] for role in list(shares)[:2]},
+            "reason": "test big integer",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["data"]["payload"] == {"n": 10**30}
+
+
+def test_tss_reconstruct_lone_surrogate_payload():
+    """Test that strings with no UTF-8 form survive the response renderer."""
+    create_data = client.post(
+        "/tss/event",
+        content=b'{"org_id": "o", "event_type": "e", "payload": {"s": "\\ud800"}}',
+        headers={"content-type": "application/json"},
+    ).json()
+
+    response = client.post(
+        "/tss/reconstruct",
+        json={
+            "payload_id": create_data["payload_id"],
+            "provided_roles": create_data["shares_demo"],
+            "reason": "test lone surrogate",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["data"]["payload"] == {"s": "\ud800"}
+
+
+def test_tss_event_rejects_non_finite_floats():
+    """Test that NaN payloads are refused rather than stored as null."""
+    response = client.post(
+        "/tss/event",
+        content=b'{"org_id": "o", "event_type": "e", "payload": {"x": NaN}}',
+        headers={"content-type": "application/json"},
+    )
+    assert response.status_code == 422
+
+
 def test_tss_reconstruct_insufficient_shares():
     """Test TSS reconstruction with insufficient shares."""
     # First create an event
@@ -134,8 +215,7 @@ def test_tss_reconstruct_insufficient_shares():
         },
     )
 
-    if create_response.status_code != 200:
-        pytest.skip("TSS not available")
+    assert create_response.status_code == 200
 
     create_data = create_response.json()
     payload_id = create_data["payload_id"]
@@ -155,3 +235,23 @@ def test_tss_reconstruct_insufficient_shares():
     )
 
     assert response.status_code == 403
+
+
+def test_static_assets_served_from_memory():
+    """Test that front-end assets are served with ETags and data files are not."""
+    response = client.get("/static/")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+
+    etag = response.headers["etag"]
+    for if_none_match in (etag, f'"other", {etag}', f"W/{etag}", "*"):
+        cached = client.get("/static/", headers={"If-None-Match": if_none_match})
+        assert cached.status_code == 304
+    stale = client.get("/static/", headers={"If-None-Match": '"other"'})
+    assert stale.status_code == 200
+
+    assert client.get("/static/styles.css").status_code == 200
+    head = client.head("/static/")
+    assert head.status_code == 200
+    assert head.headers["etag"] == etag
+    assert client.get("/static/question_bank.csv").status_code == 404
@@ -2,6 +2,8 @@
 Smoke tests for basic functionality.
 """
 
+import os
+
 
 def test_imports():
     """Test that core modules can be imported."""
@@ -33,3 +35,63 @@ def test_rules_loaded():
     from engine_reference import RULES
 
     assert isinstance(RULES, dict)
+
+
+def test_rules_json_cache(tmp_path):
+    """Test that rules are served from the JSON sidecar while the YAML matches."""
+    import json
+
+    from engine_reference import load_rules
+
+    rules_path = tmp_path / "rules.yaml"
+    rules_path.write_text("feedback: {correct: {short: Great}}\n", encoding="utf-8")
+
+    assert load_rules(str(rules_path)) == {"feedback": {"correct": {"short": "Great"}}}
+    cache_path = tmp_path / "rules.yaml.json"
+    cached = json.loads(cache_path.read_text(encoding="utf-8"))
+
+    cached["rules"] = {"from": "cache"}
+    cache_path.write_text(json.dumps(cached), encoding="utf-8")
+    assert load_rules(str(rules_path)) == {"from": "cache"}
+
+    # Edited YAML is re-read even when it keeps an older mtime (cp -p, rsync -a)
+    rules_path.write_text("feedback: {correct: {short: Nice}}\n", encoding="utf-8")
+    os.utime(rules_path, (1_000_000, 1_000_000))
+    os.utime(cache_path, (1_000_010, 1_000_010))
+    assert load_rules(str(rules_path)) == {"feedback": {"correct": {"short": "Nice"}}}
+
+
+def test_pick_question_prefers_role_modules():
+    """Test that picking draws from the modules preferred for the role."""
+    from engine_reference import BANK, MODULE_INDEX, ROLE_POOLS, pick_question
+
+    assert sum(len(ids) for ids in MODULE_INDEX.values()) > 0
+    assert all(BANK[qid]["module"] in (1, 2) for qid in ROLE_POOLS["support"])
+    question = pick_question({"role": "support", "attempted": []})
+    assert question["module"] in (1, 2)
+
+
+def test_safe_eval_rule():
+    """Test simple equality conditions and unsupported expressions."""
+    from engine_reference import safe_eval_rule
+
+    assert safe_eval_rule("role == 'support'", {"role": "support"}) is True
+    assert safe_eval_rule("role == 'support'", {"role": "instructor"}) is False
+    assert safe_eval_rule("role != 'support'", {"role": "support"}) is False
+
+
+def test_compile_role_rules():
+    """Test role rules compile through the same parser as safe_eval_rule."""
+    from engine_reference import compile_role_rules
+
+    rules = {
+        "branches": {
+            "role": [
+                {"when": "role == 'support'", "prefer_modules": [1, 2]},
+                {"when": "level == 'senior'", "prefer_modules": [3]},
+                {"when": "role != 'support'", "prefer_modules": [4]},
+                {"when": 'role == "support"', "prefer_modules": [5]},
+            ]
+        }
+    }
+    assert compile_role_rules(rules) == {"support": (1, 2, 5)}
@@ -3,6 +3,7 @@ Tests for TSS crypto functionality.
 """
 
 import pytest
+from cryptography.exceptions import InvalidTag
 from tss_crypto import (
     base64_encode,
     base64_decode,
@@ -10,8 +11,10 @@ from tss_crypto import (
     decrypt_payload,
     tss_create,
     tss_reconstruct,
-    SecretSharingUnavailableError,
-    SECRETSHARING_AVAILABLE,
+    split_key_shamir,
+    combine_shares_shamir,
+    wrap_share,
+    TSS_AAD,
 )
 
 
@@ -36,9 +39,17 @@ def test_encrypt_decrypt():
     assert decrypted == payload
 
 
-@pytest.mark.skipif(
-    not SECRETSHARING_AVAILABLE, reason="secretsharing library not installed"
-)
+def test_encrypt_decrypt_with_aad():
+    """Test that associated data is recorded and must match on decryption."""
+    artifact, key = encrypt_payload(b"secret message", aad=b"context")
+    assert artifact["meta"]["aad"] == base64_encode(b"context")
+    assert decrypt_payload(artifact, key) == b"secret message"
+
+    artifact["meta"]["aad"] = base64_encode(b"other")
+    with pytest.raises(InvalidTag):
+        decrypt_payload(artifact, key)
+
+
 def test_tss_create_reconstruct():
     """Test TSS creation and reconstruction."""
     payload = {"org_id": "test-org", "event_type": "test", "payload": {"key": "value"}}
@@ -49,6 +60,7 @@ def test_tss_create_reconstruct():
     assert "cipher" in artifact
     assert "shares" in artifact
     assert "payload_hash" in artifact
+    assert len(artifact["cipher_digest"]) == 32
     assert len(artifact["shares"]) == 3
 
     # Test reconstruction with 2 shares
@@ -61,9 +73,60 @@ def test_tss_create_reconstruct():
     assert reconstructed == payload
 
 
-@pytest.mark.skipif(
-    not SECRETSHARING_AVAILABLE, reason="secretsharing library not installed"
-)
+def test_tss_reconstruct_below_threshold():
+    """Test that reconstruction rejects fewer shares than the threshold."""
+    artifact = tss_create({"test": "data"}, threshold=3)
+    assert artifact["cipher"]["meta"]["t"] == 3
+
+    provided_roles = {s["owner_role"]: s["wrapped_share"] for s in artifact["shares"]}
+    provided_roles.pop("regulator")
+    with pytest.raises(ValueError):
+        tss_reconstruct(artifact["cipher"], provided_roles)
+
+
+def test_tss_reconstruct_rejects_forged_envelope():
+    """Test that an envelope encrypted without the TSS AAD is not accepted."""
+    artifact, key = encrypt_payload(b'{"forged":true}')
+    assert artifact["meta"]["aad"] is None
+    artifact["meta"]["t"] = 2
+    provided_roles = {
+        role: wrap_share(share)
+        for role, share in zip(("user", "operator"), split_key_shamir(key, 2, 3))
+    }
+    with pytest.raises(ValueError):
+        tss_reconstruct(artifact, provided_roles)
+
+    # Claiming the AAD in the metadata does not help without binding to it
+    artifact["meta"]["aad"] = base64_encode(TSS_AAD)
+    with pytest.raises(InvalidTag):
+        tss_reconstruct(artifact, provided_roles)
+
+
+def test_tss_round_trip_outside_orjson_range():
+    """Test payloads orjson cannot encode still round-trip exactly."""
+    for payload in ({"n": 10**30}, {1: "a"}, {1: "a", "b": 2}):
+        artifact = tss_create(payload)
+        provided_roles = {
+            s["owner_role"]: s["wrapped_share"] for s in artifact["shares"][:2]
+        }
+        reconstructed = tss_reconstruct(artifact["cipher"], provided_roles)
+        assert reconstructed == {str(k): v for k, v in payload.items()}
+
+
+def test_tss_round_trip_lone_surrogate():
+    """Test that strings with no UTF-8 form still round-trip exactly."""
+    artifact = tss_create({"s": "\ud800"})
+    provided_roles = {s["owner_role"]: s["wrapped_share"] for s in artifact["shares"]}
+    assert tss_reconstruct(artifact["cipher"], provided_roles) == {"s": "\ud800"}
+
+
+def test_tss_create_rejects_non_finite_floats():
+    """Test that NaN and Infinity are refused instead of stored as null."""
+    for value in (float("nan"), float("inf"), [float("-inf")]):
+        with pytest.raises(ValueError):
+            tss_create({"x": value})
+
+
 def test_tss_roles():
     """Test that default roles are created correctly."""
     payload = {"test": "data"}
@@ -73,8 +136,29 @@ def test_tss_roles():
     assert roles == {"user", "operator", "regulator"}
 
 
-def test_secretsharing_error_message():
-    """Test that SecretSharingUnavailableError has clear message."""
-    error = SecretSharingUnavailableError()
-    assert "secretsharing" in str(error).lower()
-    assert "pip install" in str(error).lower()
+def test_payload_hash_ignores_key_order():
+    """Test that payload_hash does not depend on dict insertion order."""
+    first = tss_create({"a": 1, "b": {"c": 2, "d": 3}})
+    second = tss_create({"b": {"d": 3, "c": 2}, "a": 1})
+
+    assert first["payload_hash"] == second["payload_hash"]
+
+
+def test_shamir_any_threshold_subset():
+    """Test that any threshold-sized subset of shares recovers the key."""
+    key = bytes(range(32))
+    shares = split_key_shamir(key, threshold=3, parts=5)
+
+    assert len(shares) == 5
+    assert all(len(share) == len(key) + 1 for share in shares)
+    assert combine_shares_shamir(shares[:3]) == key
+    assert combine_shares_shamir([shares[4], shares[1], shares[3]]) == key
+    assert combine_shares_shamir(shares[:2]) != key
+
+
+def test_shamir_invalid_parameters():
+    """Test that impossible threshold/parts combinations are rejected."""
+    with pytest.raises(ValueError):
+        split_key_shamir(b"key", threshold=4, parts=3)
+    with pytest.raises(ValueError):
+        combine_shares_shamir([b"\x01\x00", b"\x01\x00"])
@@ -6,75 +6,217 @@ Provides threshold secret sharing for payload encryption.
 import base64
 import hashlib
 import json
+import math
 import os
-from typing import Any, Dict, List, Tuple
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 try:
-    from secretsharing import PlaintextToHexSecretSharer as SSS
+    import orjson
 
-    SECRETSHARING_AVAILABLE = True
+    ORJSON_AVAILABLE = True
 except ImportError:
-    SSS = None
-    SECRETSHARING_AVAILABLE = False
+    orjson = None
+    ORJSON_AVAILABLE = False
 
+try:
+    import pybase64
+
+    PYBASE64_AVAILABLE = True
+except ImportError:
+    pybase64 = None
+    PYBASE64_AVAILABLE = False
 
-class SecretSharingUnavailableError(RuntimeError):
-    """Raised when secretsharing library is not available."""
 
-    def __init__(self):
-        super().__init__(
-            "The 'secretsharing' library is not installed. "
-            "Install it with: pip install secretsharing"
-        )
+# Default share holders, in share order
+_ROLES = ("user", "operator", "regulator")
+
+# Associated data binding TSS ciphertexts to this envelope format
+TSS_AAD = b"kfp::tss::v1"
+
+
+def _build_gf256_tables() -> Tuple[List[int], List[int]]:
+    """Build exp/log tables for GF(2^8) with the AES polynomial and generator 3."""
+    exp = [0] * 510
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = exp[i + 255] = x
+        log[x] = i
+        # Multiply by the generator: x * 3 == x * 2 ^ x, reduced by 0x11B
+        x ^= (x << 1) ^ (0x11B if x & 0x80 else 0)
+    return exp, log
+
+
+# exp is doubled in length so log sums never need reducing mod 255
+GF256_EXP, GF256_LOG = _build_gf256_tables()
+
+
+def _gf256_mul(a: int, b: int) -> int:
+    """Multiply two GF(2^8) elements."""
+    if a == 0 or b == 0:
+        return 0
+    return GF256_EXP[GF256_LOG[a] + GF256_LOG[b]]
+
+
+def _gf256_div(a: int, b: int) -> int:
+    """Divide GF(2^8) element a by non-zero element b."""
+    if a == 0:
+        return 0
+    return GF256_EXP[GF256_LOG[a] - GF256_LOG[b] + 255]
+
+
+@lru_cache(maxsize=256)
+def _gf256_mul_table(c: int) -> bytes:
+    """Translation table mapping every byte v to c * v, for bytes.translate."""
+    return bytes(_gf256_mul(c, v) for v in range(256))
+
+
+def _xor_bytes(a: bytes, b: bytes) -> bytes:
+    """XOR two equal-length byte strings in a single big-integer operation."""
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).to_bytes(len(a), "big")
+
+
+def _reject_non_finite(obj: Any) -> None:
+    """Raise ValueError if obj holds NaN or Infinity, which orjson writes as null."""
+    if isinstance(obj, float):
+        if not math.isfinite(obj):
+            raise ValueError("Out of range float values are not JSON compliant")
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _reject_non_finite(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _reject_non_finite(value)
+
+
+def _str_keys(obj: Any) -> Any:
+    """Copy obj with non-str dict keys spelled the way json.dumps spells them."""
+    if isinstance(obj, dict):
+        copy = {}
+        for key, value in obj.items():
+            # bool is an int subclass, so True/False become "true"/"false"
+            if key is None or isinstance(key, (int, float)):
+                key = json.dumps(key)
+            copy[key] = _str_keys(value)
+        return copy
+    if isinstance(obj, (list, tuple)):
+        return [_str_keys(value) for value in obj]
+    return obj
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """
+    Serialize to compact UTF-8 JSON bytes in the same layout as orjson.
+
+    Keys are sorted so equal payloads always hash to the same payload_hash.
+    orjson is only a speedup: anything it refuses (integers beyond 64 bits,
+    non-str keys, lone surrogates) goes through the stdlib path instead.
+
+    Raises:
+        ValueError: If obj holds NaN or Infinity, on either backend
+    """
+    if ORJSON_AVAILABLE:
+        _reject_non_finite(obj)
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:  # orjson.JSONEncodeError subclasses TypeError
+            pass
+    options: Dict[str, Any] = {
+        "separators": (",", ":"),
+        "sort_keys": True,
+        "allow_nan": False,
+        "ensure_ascii": False,
+    }
+    try:
+        text = json.dumps(obj, **options)
+    except TypeError:
+        # sort_keys cannot order mixed key types such as {1: "a", "b": 2}
+        obj = _str_keys(obj)
+        text = json.dumps(obj, **options)
+    try:
+        return text.encode()
+    except UnicodeEncodeError:
+        # Lone surrogates have no UTF-8 form; \u escapes keep them intact
+        return json.dumps(obj, **{**options, "ensure_ascii": True}).encode()
+
+
+# Decoding stays on the stdlib: orjson.loads turns integers beyond 64 bits
+# into floats without raising, so it cannot fall back the same way
+_json_loads = json.loads
 
 
 def base64_encode(data: bytes) -> str:
     """Encode bytes to base64 string."""
-    return base64.b64encode(data).decode()
+    # pybase64 wraps libbase64's SIMD kernels; the stdlib module is the fallback
+    if PYBASE64_AVAILABLE:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode("ascii")
 
 
 def base64_decode(data: str) -> bytes:
     """Decode base64 string to bytes."""
-    return base64.b64decode(data.encode())
-
+    # Both decoders accept ASCII str directly, so no .encode() copy is needed
+    if PYBASE64_AVAILABLE:
+        return pybase64.b64decode(data)
+    return base64.b64decode(data)
 
-def encrypt_payload(payload: bytes) -> Tuple[Dict[str, Any], bytes]:
-    """
-    Encrypt payload using AES-GCM.
 
-    Args:
-        payload: Raw bytes to encrypt
+def _encrypt_raw(
+    payload: bytes, aad: Optional[bytes] = None
+) -> Tuple[bytes, bytes, bytes]:
+    """Encrypt payload under a fresh AES-GCM key; returns (key, nonce, ciphertext)."""
+    # One urandom draw covers both the 256-bit key and the 96-bit nonce
+    material = os.urandom(44)
+    key, nonce = material[:32], material[32:]
+    return key, nonce, AESGCM(key).encrypt(nonce, payload, aad)
 
-    Returns:
-        Tuple of (cipher artifact dict, encryption key)
-    """
-    key = AESGCM.generate_key(bit_length=256)
-    aes = AESGCM(key)
-    nonce = os.urandom(12)
-    ciphertext = aes.encrypt(nonce, payload, None)
 
-    artifact = {
+def _cipher_artifact(
+    nonce: bytes, ciphertext: bytes, aad: Optional[bytes] = None
+) -> Dict[str, Any]:
+    """Build the JSON-friendly cipher artifact for a ciphertext."""
+    return {
         "ciphertext_b64": base64_encode(ciphertext),
         "meta": {
             "alg": "AES-GCM",
             "nonce": base64_encode(nonce),
-            "aad": None,
+            "aad": base64_encode(aad) if aad is not None else None,
             "v": "1",
         },
     }
 
-    return artifact, key
+
+def encrypt_payload(
+    payload: bytes, aad: Optional[bytes] = None
+) -> Tuple[Dict[str, Any], bytes]:
+    """
+    Encrypt payload using AES-GCM.
+
+    Args:
+        payload: Raw bytes to encrypt
+        aad: Optional associated data authenticated alongside the payload
+
+    Returns:
+        Tuple of (cipher artifact dict, encryption key)
+    """
+    key, nonce, ciphertext = _encrypt_raw(payload, aad)
+    return _cipher_artifact(nonce, ciphertext, aad), key
 
 
-def decrypt_payload(artifact: Dict[str, Any], key: bytes) -> bytes:
+def decrypt_payload(
+    artifact: Dict[str, Any], key: bytes, aad: Optional[bytes] = None
+) -> bytes:
     """
     Decrypt payload using AES-GCM.
 
     Args:
         artifact: Cipher artifact containing ciphertext and metadata
         key: Encryption key
+        aad: Associated data the caller expects; when given it is used instead
+            of whatever the artifact itself records
 
     Returns:
         Decrypted payload bytes
@@ -82,12 +224,18 @@ def decrypt_payload(artifact: Dict[str, Any], key: bytes) -> bytes:
     aes = AESGCM(key)
     nonce = base64_decode(artifact["meta"]["nonce"])
     ciphertext = base64_decode(artifact["ciphertext_b64"])
-    return aes.decrypt(nonce, ciphertext, None)
+    if aad is None:
+        recorded = artifact["meta"].get("aad")
+        aad = base64_decode(recorded) if recorded else None
+    return aes.decrypt(nonce, ciphertext, aad)
 
 
-def split_key_shamir(key: bytes, threshold: int = 2, parts: int = 3) -> List[str]:
+def split_key_shamir(key: bytes, threshold: int = 2, parts: int = 3) -> List[bytes]:
     """
-    Split encryption key using Shamir's Secret Sharing.
+    Split encryption key using Shamir's Secret Sharing over GF(2^8).
+
+    Each key byte is the constant term of its own random polynomial of degree
+    threshold - 1; share x holds every polynomial evaluated at x.
 
     Args:
         key: Encryption key to split
@@ -95,62 +243,91 @@ def split_key_shamir(key: bytes, threshold: int = 2, parts: int = 3) -> List[str
         parts: Total number of shares to create
 
     Returns:
-        List of share strings
+        List of raw shares: one x-coordinate byte followed by len(key) bytes
 
     Raises:
-        SecretSharingUnavailableError: If secretsharing library not installed
+        ValueError: If threshold and parts do not satisfy 1 <= t <= n <= 255
     """
-    if not SECRETSHARING_AVAILABLE or SSS is None:
-        raise SecretSharingUnavailableError()
+    if not 1 <= threshold <= parts <= 255:
+        raise ValueError(
+            f"Invalid threshold/parts: need 1 <= {threshold} <= {parts} <= 255"
+        )
+
+    # Highest-degree coefficients first, constant term (the key) last
+    coefficients = [os.urandom(len(key)) for _ in range(threshold - 1)] + [key]
 
-    return SSS.split_secret(key.hex(), threshold, parts)
+    # Horner's rule applied to all key bytes at once: translate multiplies
+    # every byte by x, and the XOR adds the next coefficient row
+    shares = []
+    for x in range(1, parts + 1):
+        mul_x = _gf256_mul_table(x)
+        y = coefficients[0]
+        for coefficient in coefficients[1:]:
+            y = _xor_bytes(y.translate(mul_x), coefficient)
+        shares.append(bytes([x]) + y)
+    return shares
 
 
-def combine_shares_shamir(shares: List[str]) -> bytes:
+def combine_shares_shamir(shares: List[bytes]) -> bytes:
     """
     Combine Shamir shares to reconstruct key.
 
     Args:
-        shares: List of share strings
+        shares: List of raw shares as produced by split_key_shamir
 
     Returns:
         Reconstructed encryption key
 
     Raises:
-        SecretSharingUnavailableError: If secretsharing library not installed
+        ValueError: If shares are malformed, duplicated, or of unequal length
     """
-    if not SECRETSHARING_AVAILABLE or SSS is None:
-        raise SecretSharingUnavailableError()
-
-    return bytes.fromhex(SSS.recover_secret(shares))
-
-
-def wrap_share(share: str, key_id: str) -> str:
+    if not shares or not all(shares):
+        raise ValueError("At least one non-empty share is required")
+    points = [(share[0], share[1:]) for share in shares]
+
+    xs = [x for x, _ in points]
+    if len(set(xs)) != len(xs) or 0 in xs:
+        raise ValueError("Shares must have distinct indices in 1..255")
+    size = len(points[0][1])
+    if any(len(y) != size for _, y in points):
+        raise ValueError("Shares must all have the same length")
+
+    # Lagrange interpolation at x = 0; subtraction in GF(2^8) is XOR.
+    # Each share is scaled by its basis weight with one translate call.
+    key = 0
+    for i, (xi, yi) in enumerate(points):
+        basis = 1
+        for j, xj in enumerate(xs):
+            if j != i:
+                basis = _gf256_mul(basis, _gf256_div(xj, xj ^ xi))
+        key ^= int.from_bytes(yi.translate(_gf256_mul_table(basis)), "big")
+    return key.to_bytes(size, "big")
+
+
+def wrap_share(share: bytes) -> str:
     """
     Wrap a share for storage/transmission.
 
     Args:
-        share: Share string to wrap
-        key_id: Key identifier (unused in current implementation)
+        share: Raw share bytes to wrap
 
     Returns:
         Base64-encoded wrapped share
     """
-    return base64_encode(share.encode())
+    return base64_encode(share)
 
 
-def unwrap_share(wrapped: str, key_id: str) -> str:
+def unwrap_share(wrapped: str) -> bytes:
     """
     Unwrap a share from storage/transmission format.
 
     Args:
         wrapped: Wrapped share string
-        key_id: Key identifier (unused in current implementation)
 
     Returns:
-        Original share string
+        Original raw share bytes
     """
-    return base64_decode(wrapped).decode()
+    return base64_decode(wrapped)
 
 
 def tss_create(payload: Dict[str, Any], threshold: int = 2) -> Dict[str, Any]:
@@ -165,29 +342,34 @@ def tss_create(payload: Dict[str, Any], threshold: int = 2) -> Dict[str, Any]:
         threshold: Minimum shares needed to decrypt (default 2)
 
     Returns:
-        Dictionary containing cipher artifact, shares, and payload hash
+        Dictionary containing cipher artifact, shares, payload hash, and the
+        raw SHA-256 digest of the ciphertext bytes (cipher_digest)
 
     Raises:
-        SecretSharingUnavailableError: If secretsharing library not installed
+        ValueError: If threshold is not between 1 and 3
     """
-    # Serialize and encrypt
-    raw_bytes = json.dumps(payload).encode()
-    artifact, key = encrypt_payload(raw_bytes)
+    # Serialize, then hash and encrypt back to back while the bytes are hot
+    raw_bytes = _json_dumps(payload)
+    payload_hash = hashlib.sha256(raw_bytes).hexdigest()
+    key, nonce, ciphertext = _encrypt_raw(raw_bytes, TSS_AAD)
+    artifact = _cipher_artifact(nonce, ciphertext, TSS_AAD)
+    artifact["meta"]["t"] = threshold
 
     # Split key into shares
-    shares = split_key_shamir(key, threshold, 3)
-    roles = ["user", "operator", "regulator"]
+    shares = split_key_shamir(key, threshold, len(_ROLES))
 
     # Wrap shares for each role
     wrapped_shares = [
-        {"owner_role": role, "wrapped_share": wrap_share(share, f"kfp::{role}")}
-        for role, share in zip(roles, shares)
+        {"owner_role": role, "wrapped_share": wrap_share(share)}
+        for role, share in zip(_ROLES, shares)
     ]
 
-    # Compute payload hash
-    payload_hash = hashlib.sha256(raw_bytes).hexdigest()
-
-    return {"cipher": artifact, "shares": wrapped_shares, "payload_hash": payload_hash}
+    return {
+        "cipher": artifact,
+        "shares": wrapped_shares,
+        "payload_hash": payload_hash,
+        "cipher_digest": hashlib.sha256(ciphertext).digest(),
+    }
 
 
 def tss_reconstruct(
@@ -204,17 +386,25 @@ def tss_reconstruct(
         Decrypted payload dictionary
 
     Raises:
-        SecretSharingUnavailableError: If secretsharing library not installed
+        ValueError: If the artifact is not bound to TSS_AAD, fewer shares than
+            the threshold are provided, or the shares cannot be combined
+        cryptography.exceptions.InvalidTag: If the shares yield the wrong key
     """
+    # The envelope is untrusted input: never let it choose its own AAD
+    if cipher["meta"].get("aad") != base64_encode(TSS_AAD):
+        raise ValueError("Cipher artifact is not bound to the TSS envelope")
+
+    # Reject short share sets before doing any decoding work
+    threshold = cipher["meta"].get("t", 2)
+    if len(provided_roles) < threshold:
+        raise ValueError(f"Need at least {threshold} shares, got {len(provided_roles)}")
+
     # Unwrap shares
-    plain_shares = [
-        unwrap_share(wrapped, f"kfp::{role}")
-        for role, wrapped in provided_roles.items()
-    ]
+    plain_shares = [unwrap_share(wrapped) for wrapped in provided_roles.values()]
 
     # Reconstruct key
     key = combine_shares_shamir(plain_shares)
 
     # Decrypt payload
-    decrypted = decrypt_payload(cipher, key)
-    return json.loads(decrypted.decode())
+    decrypted = decrypt_payload(cipher, key, aad=TSS_AAD)
+    return _json_loads(decrypted)